@@ -1,15 +1,24 @@
 import logging
 
+from redis import StrictRedis
 from tornado.ioloop import IOLoop
 from tornado.web import Application, StaticFileHandler, url
 from tornado.httpserver import HTTPServer
 from tornado.options import options
 
 import settings as conf
+from apps.core.admission import AdmissionPolicy
+from apps.core.cache import fragment_cache
+from apps.core.handlers import JobStatusHandler, MediaFileHandler
+from apps.core.jobs import job_queue
 from apps.home.handlers import MainHandler
 from apps.account.handlers import (LoginHandler, LogoutHandler, SignupHandler,
-                                   ProfileHandler)
-from apps.events.handlers import EventsHandler, EventsWebSocketHandler
+                                   ProfileHandler, PhotoUploadHandler)
+from apps.events import notifications
+from apps.events.handlers import (EventsHandler, EventsSearchHandler,
+                                  EventsAutocompleteHandler,
+                                  EventsSyncHandler, EventsFeedHandler,
+                                  InvitationHandler, EventsWebSocketHandler)
 
 
 logger = logging.getLogger(__name__)
@@ -23,6 +32,19 @@ class CalendIO(Application):
         # self.jinja_env.filters.update(filters.register_filters())
         self.jinja_env.tests.update({})
         self.jinja_env.globals['settings'] = conf.APP_SETTINGS
+        cache_conf = conf.FRAGMENT_CACHE
+        fragment_cache.configure(
+            StrictRedis(host=conf.REDIS['host'], port=conf.REDIS['port'],
+                        db=cache_conf['redis_db'],
+                        socket_timeout=cache_conf['redis_timeout']),
+            timeout=cache_conf['timeout'], l1_size=cache_conf['l1_size'],
+            versions_ttl=cache_conf['versions_ttl'])
+        # Deferred work (e.g. images resizing) is done by workers
+        job_queue.configure(
+            StrictRedis(host=conf.REDIS['host'], port=conf.REDIS['port'],
+                        db=conf.JOB_QUEUE['redis_db']),
+            result_ttl=conf.JOB_QUEUE['result_ttl'])
+        self.jobs = job_queue
 
         url_patterns = [
             url(r'/', MainHandler, name='index'),
@@ -30,11 +52,39 @@ class CalendIO(Application):
             url(r'/logout', LogoutHandler, name='logout'),
             url(r'/signup', SignupHandler, name='signup'),
             url(r'/profile', ProfileHandler, name='profile'),
+            url(r'/profile/photo', PhotoUploadHandler, name='profile_photo'),
             url(r'/events', EventsHandler, name='events'),
+            url(r'/events/search', EventsSearchHandler, name='events_search'),
+            url(r'/events/autocomplete', EventsAutocompleteHandler,
+                name='events_autocomplete'),
+            url(r'/events/sync', EventsSyncHandler, name='events_sync'),
+            url(r'/events/feed', EventsFeedHandler, name='events_feed'),
+            url(r'/events/(\w+)/invitation', InvitationHandler,
+                name='invitation'),
             url(r'/ws', EventsWebSocketHandler, name='ws'),
+            url(r'/jobs/(\w+)', JobStatusHandler, name='job'),
             url(r'/static/(.*)', StaticFileHandler, {'path': 'static/'}),
+            url(r'/media/(.*)', MediaFileHandler,
+                {'database': conf.APP_SETTINGS['db'],
+                 'root_collection': conf.APP_SETTINGS['media_collection']},
+                name='media'),
         ]
 
+        notifications.configure(
+            StrictRedis(host=conf.REDIS['host'], port=conf.REDIS['port'],
+                        db=conf.NOTIFICATIONS['redis_db']))
+
+        # Admission control for expensive routes
+        admission_conf = conf.ADMISSION_CONTROL
+        self.admission = AdmissionPolicy.from_settings(
+            admission_conf,
+            StrictRedis(host=conf.REDIS['host'], port=conf.REDIS['port'],
+                        db=admission_conf['redis_db'],
+                        socket_timeout=admission_conf['redis_timeout']))
+        for spec in url_patterns:
+            if spec.name in self.admission:
+                spec.kwargs['admission'] = self.admission[spec.name]
+
         super(CalendIO, self).__init__(url_patterns, *args,
                                        **dict(conf.APP_SETTINGS, **kwargs))
 
@@ -43,6 +93,7 @@ def main():
     http_server = HTTPServer(CalendIO(), xheaders=True)
     http_server.listen(options.port)
     loop = IOLoop.instance()
+    notifications.start_listener(loop)
     logger.info('Server running on http://localhost:{0}'.format(options.port))
     loop.start()
 
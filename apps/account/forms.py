@@ -20,6 +20,7 @@ class RegistrationForm(ModelForm):
                                           [validators.InputRequired()])
 
     _model = User
+    _compiled = True
     text_errors = {
         'password_mismatch': 'Password mismatch.',
         'email_occupied': 'Already taken.',
@@ -51,6 +52,7 @@ class ProfileForm(ModelForm):
     birth_date = DateField('Date of Birth', [])
 
     _model = User
+    _compiled = True
     text_errors = {
 
     }
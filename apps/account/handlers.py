@@ -1,11 +1,15 @@
 import logging
 
+import motor
 from tornado import gen
+from tornado.ioloop import IOLoop
+from tornado.web import stream_request_body
 from pymongo.errors import DuplicateKeyError
 
 from ..core.handlers import BaseHandler, AuthMixin
 from ..core.utils import is_loggedin, authenticated
 from .forms import RegistrationForm, LoginForm, ProfileForm
+from .jobs import photo_variants
 from .models import User
 
 logger = logging.getLogger(__name__)
@@ -92,3 +96,81 @@ class ProfileHandler(BaseHandler, AuthMixin):
             obj=obj,
         )
         self.render('account/profile.html', **response)
+
+
+@stream_request_body
+class PhotoUploadHandler(BaseHandler):
+    """
+    Receives profile photo. Body is written to GridFS as it arrives, so
+    workers can read it, resizing is done by the `photo_variants` job, its
+    id is returned to check the status.
+    """
+
+    _upload = None
+
+    @gen.coroutine
+    def prepare(self):
+        super(PhotoUploadHandler, self).prepare()
+        if self._finished:
+            return
+        if not self.current_user:
+            self.send_error(403)
+            return
+        self._max_size = self.settings['photo_upload']['max_size']
+        content_length = int(self.request.headers.get('Content-Length', 0))
+        if content_length > self._max_size:
+            self.send_error(413)
+            return
+        self.request.connection.set_max_body_size(self._max_size)
+        self._upload = motor.MotorGridIn(
+            self.db[self.settings['photo_upload']['collection']],
+            content_type=self.request.headers.get('Content-Type', ''))
+        self._received = 0
+
+    @gen.coroutine
+    def data_received(self, chunk):
+        if self._upload is None:
+            return
+        self._received += len(chunk)
+        if self._received > self._max_size:
+            self.send_error(413)
+            yield self._remove_upload()
+            return
+        yield self._upload.write(chunk)
+
+    @gen.coroutine
+    def post(self):
+        if self._finished:
+            # Upload was rejected while receiving
+            return
+        # Upload is removed by the job now, not on connection close
+        upload, self._upload = self._upload, None
+        yield upload.close()
+        upload_id = upload._id
+        job_id = self.application.jobs.enqueue(
+            photo_variants.job_name,
+            [self.current_user, upload_id,
+             self.settings['photo_upload']['collection'],
+             self.settings['media_collection'],
+             self.settings['photo_upload']['sizes']],
+            owner=self.current_user)
+        self.set_status(202)
+        self.render_json({
+            'job_id': job_id,
+            'status_url': self.reverse_url('job', job_id),
+        })
+
+    def on_connection_close(self):
+        super(PhotoUploadHandler, self).on_connection_close()
+        IOLoop.current().spawn_callback(self._remove_upload)
+
+    @gen.coroutine
+    def _remove_upload(self):
+        if self._upload is None:
+            return
+        upload, self._upload = self._upload, None
+        # Chunks written so far are removed with the file
+        yield upload.close()
+        yield motor.MotorGridFS(
+            self.db, self.settings['photo_upload']['collection']
+        ).delete(upload._id)
@@ -0,0 +1,55 @@
+"""
+Image processing functions. They are CPU bound, so they are executed by
+the jobs workers.
+"""
+import hashlib
+from io import BytesIO
+
+from PIL import Image
+from tornado.httputil import parse_body_arguments
+
+# Larger images are rejected before decoding, they could exhaust memory
+MAX_PIXELS = 25 * 1000 * 1000
+
+
+def read_upload(body, content_type):
+    """
+    Returns uploaded file content. Upload is either the raw file or
+    `multipart/form-data` body, then the first file of it is taken.
+    """
+    if content_type.startswith('multipart/form-data'):
+        arguments, files = {}, {}
+        parse_body_arguments(content_type, body, arguments, files)
+        for file_list in files.values():
+            if file_list:
+                return file_list[0]['body']
+        raise ValueError('No file in upload.')
+    return body
+
+
+def make_photo_variants(upload, content_type, sizes):
+    """
+    Resizes uploaded photo to every `(width, height)` of `sizes` dict.
+    Variants are named by the content hash, so they never change and can be
+    cached forever.
+    Returns `(photo_name, {size_name: (file_name, jpeg_data)})`.
+    """
+    body = read_upload(upload, content_type)
+    photo_name = hashlib.sha1(body).hexdigest()
+    image = Image.open(BytesIO(body))
+    width, height = image.size
+    if width * height > MAX_PIXELS:
+        raise ValueError('Image is larger than {0} pixels.'.format(
+            MAX_PIXELS))
+    image.load()
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    variants = {}
+    for size_name, size in sizes.items():
+        file_name = '{0}_{1}.jpg'.format(photo_name, size_name)
+        variant = image.copy()
+        variant.thumbnail(size, Image.ANTIALIAS)
+        data = BytesIO()
+        variant.save(data, 'JPEG', quality=85, optimize=True)
+        variants[size_name] = (file_name, data.getvalue())
+    return photo_name, variants
@@ -0,0 +1,47 @@
+from bson import ObjectId
+from gridfs import GridFS
+from gridfs.errors import NoFile
+
+from ..core.jobs import job, JobFailed
+from .images import make_photo_variants
+from .models import User
+
+
+@job('account.photo_variants')
+def photo_variants(worker, user, upload_id, uploads_collection,
+                   media_collection, sizes):
+    """
+    Makes variants of uploaded profile photo and sets it to the user.
+    Upload and variants are stored in GridFS, so workers don't share files
+    with web servers. Upload is removed when the job is finished or it has
+    no retries left.
+    """
+    uploads = GridFS(worker.db, uploads_collection)
+    upload_id = ObjectId(upload_id)
+    retry = False
+    try:
+        try:
+            upload = uploads.get(upload_id)
+            photo, variants = make_photo_variants(
+                upload.read(), upload.content_type or '',
+                dict((name, tuple(size)) for name, size in sizes.items()))
+        except (NoFile, IOError, ValueError) as e:
+            raise JobFailed('Bad photo: {0}'.format(e))
+        media = GridFS(worker.db, media_collection)
+        for file_name, data in variants.values():
+            # Same photo is uploaded again
+            if not media.exists(filename=file_name):
+                media.put(data, filename=file_name, content_type='image/jpeg')
+        worker.db[User.MONGO_COLLECTION].update({'email': user},
+                                                {'$set': {'photo': photo}})
+    except JobFailed:
+        raise
+    except Exception:
+        retry = not worker.last_attempt
+        raise
+    finally:
+        if not retry:
+            uploads.delete(upload_id)
+    variants = dict((size_name, file_name)
+                    for size_name, (file_name, _) in variants.items())
+    return {'photo': photo, 'variants': variants}
@@ -0,0 +1,163 @@
+import logging
+import math
+import time
+
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """
+    In-process token bucket: `rate` tokens per second, at most `burst`
+    tokens are accumulated.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = self.burst
+        self._ts = time.time()
+
+    def consume(self):
+        """
+        Takes one token. Returns 0 if it is taken, otherwise number of
+        seconds until the next token is available.
+        """
+        now = time.time()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._ts) * self.rate)
+        self._ts = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+
+class RedisTokenBucket(object):
+    """
+    Token bucket shared by all processes through Redis. The bucket state is
+    updated atomically by a Lua script, so it costs one round trip.
+    If Redis is unavailable the in-process `fallback` bucket is used for
+    `REDIS_RETRY_DELAY` seconds.
+    """
+
+    REDIS_RETRY_DELAY = 5
+    SCRIPT = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(state[1]) or burst
+        local ts = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local wait = 0
+        if tokens >= 1 then
+            tokens = tokens - 1
+        else
+            wait = (1 - tokens) / rate
+        end
+        redis.call('HMSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    """
+
+    def __init__(self, redis, key, rate, burst):
+        self.key = key
+        self.rate = rate
+        self.burst = burst
+        self.fallback = TokenBucket(rate, burst)
+        self._script = redis.register_script(self.SCRIPT)
+        self._redis_down_until = 0
+
+    def consume(self):
+        now = time.time()
+        if now < self._redis_down_until:
+            return self.fallback.consume()
+        try:
+            return float(self._script(keys=[self.key],
+                                      args=[self.rate, self.burst, now]))
+        except RedisError as e:
+            logger.warning('Token bucket "{0}" falls back to in-process '
+                           'one: {1}'.format(self.key, e))
+            self._redis_down_until = now + self.REDIS_RETRY_DELAY
+            return self.fallback.consume()
+
+
+class ConcurrencyLimiter(object):
+    """
+    Limits number of requests which are handled by the process at once.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+
+    def acquire(self):
+        if self.active >= self.limit:
+            return False
+        self.active += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+
+
+class AdmissionPolicy(object):
+    """
+    Admission rules of one route. Route settings:
+        rate -- requests per second allowed for the whole cluster
+        burst -- requests allowed at once above the `rate`
+        concurrency -- requests handled by one process at once
+        retry_after -- `Retry-After` for rejections by `concurrency`
+        methods -- HTTP methods the rules are applied to
+    Any rule can be omitted.
+    """
+
+    def __init__(self, name, rate=None, burst=None, concurrency=None,
+                 retry_after=1, methods=('POST',), redis=None):
+        self.name = name
+        self.retry_after = retry_after
+        self.methods = frozenset(methods)
+        self.bucket = None
+        self.limiter = None
+        if rate:
+            burst = burst or rate
+            if redis is not None:
+                self.bucket = RedisTokenBucket(
+                    redis, 'admission:{0}'.format(name), rate, burst)
+            else:
+                self.bucket = TokenBucket(rate, burst)
+        if concurrency:
+            self.limiter = ConcurrencyLimiter(concurrency)
+
+    def applies_to(self, method):
+        return method in self.methods
+
+    def admit(self):
+        """
+        Returns None if request is admitted, otherwise tuple
+        `(status_code, retry_after)` for the rejection response.
+        Admitted requests must be `release`d when finished.
+        """
+        # Concurrency goes first, so rejected requests don't take tokens
+        if self.limiter is not None and not self.limiter.acquire():
+            return 503, self.retry_after
+        if self.bucket is not None:
+            wait = self.bucket.consume()
+            if wait:
+                self.release()
+                return 429, int(math.ceil(wait))
+        return None
+
+    def release(self):
+        if self.limiter is not None:
+            self.limiter.release()
+
+    @classmethod
+    def from_settings(cls, config, redis=None):
+        """
+        Returns dict of policies by route name.
+        """
+        return dict((name, cls(name, redis=redis, **options))
+                    for name, options in config['routes'].items())
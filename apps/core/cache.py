@@ -0,0 +1,184 @@
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+
+class FragmentCache(object):
+    """
+    Cache of rendered template fragments. Fragments are stored in Redis and
+    in the in-process LRU (L1). Fragments which need DB data are cached by
+    handlers with `key`, `get` and `set`, so DB is not queried on hits,
+    the rest ones with `{% cache %}` tag. Every fragment depends on tags
+    (e.g. `calendar:<email>`), fragment key includes current versions of
+    its tags, so `invalidate` of a tag makes all the fragments depending on
+    it stale.
+    Tag versions are kept in process for `versions_ttl` seconds, so L1 hits
+    cost no Redis requests and invalidations by other processes are seen
+    in `versions_ttl`. Without Redis only L1 cache is used.
+    """
+
+    def __init__(self):
+        self.redis = None
+        self.timeout = 3600
+        self.l1_size = 1000
+        self.versions_ttl = 5
+        self._l1 = OrderedDict()
+        self._versions = {}
+
+    def configure(self, redis=None, timeout=None, l1_size=None,
+                  versions_ttl=None):
+        self.redis = redis
+        self.timeout = timeout or self.timeout
+        self.l1_size = l1_size or self.l1_size
+        self.versions_ttl = versions_ttl or self.versions_ttl
+        self._l1.clear()
+        self._versions.clear()
+
+    def get_or_render(self, key, tags, render):
+        full_key = self.key(key, tags)
+        value = self.get(full_key)
+        if value is None:
+            value = render()
+            self.set(full_key, value)
+        return value
+
+    def key(self, key, tags):
+        """
+        Returns cache key of the fragment for current versions of its tags
+        or None if the cache is unavailable. Key is to be taken before data
+        of the fragment is read, so data read after an invalidation is never
+        stored under the older key.
+        """
+        try:
+            return self._make_key(key, tags)
+        except RedisError as e:
+            logger.warning('Fragment cache is unavailable: {0}'.format(e))
+            return None
+
+    def get(self, full_key):
+        if full_key is None:
+            return None
+        value = self._l1_get(full_key)
+        if value is not None or self.redis is None:
+            return value
+        try:
+            value = self.redis.get(full_key)
+        except RedisError as e:
+            logger.warning('Fragment cache is unavailable: {0}'.format(e))
+            return None
+        if value is not None:
+            value = value.decode('utf-8')
+            self._l1_set(full_key, value)
+        return value
+
+    def set(self, full_key, value):
+        if full_key is None:
+            return
+        self._l1_set(full_key, value)
+        if self.redis is not None:
+            try:
+                self.redis.setex(full_key, self.timeout, value)
+            except RedisError as e:
+                logger.warning('Fragment cache is unavailable: {0}'.format(e))
+
+    def invalidate(self, *tags):
+        if not tags:
+            return
+        if self.redis is None:
+            for tag in tags:
+                version = self._versions.get(tag, (None, 0))[1]
+                self._versions[tag] = (None, version + 1)
+            return
+        pipe = self.redis.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(self._tag_key(tag))
+        try:
+            versions = pipe.execute()
+        except RedisError as e:
+            logger.error('Fragment cache tags are not invalidated: '
+                         '{0}: {1}'.format(tags, e))
+            return
+        expires_at = time.time() + self.versions_ttl
+        for tag, version in zip(tags, versions):
+            self._versions[tag] = (expires_at, version)
+
+    def _tag_key(self, tag):
+        return 'fragment-tag:{0}'.format(tag)
+
+    def _get_versions(self, tags):
+        now = time.time()
+        versions = {}
+        missing = []
+        for tag in tags:
+            expires_at, version = self._versions.get(tag, (0, 0))
+            if expires_at is None or expires_at > now:
+                versions[tag] = version
+            elif self.redis is None:
+                versions[tag] = 0
+            else:
+                missing.append(tag)
+        if missing:
+            values = self.redis.mget([self._tag_key(tag) for tag in missing])
+            expires_at = now + self.versions_ttl
+            for tag, version in zip(missing, values):
+                version = int(version or 0)
+                self._versions[tag] = (expires_at, version)
+                versions[tag] = version
+        return [versions[tag] for tag in tags]
+
+    def _make_key(self, key, tags):
+        parts = [str(key)]
+        for tag, version in zip(tags, self._get_versions(tags)):
+            parts.append('{0}={1}'.format(tag, version))
+        digest = hashlib.sha1('\n'.join(parts).encode('utf-8')).hexdigest()
+        return 'fragment:{0}'.format(digest)
+
+    def _l1_get(self, full_key):
+        item = self._l1.get(full_key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.time():
+            del self._l1[full_key]
+            return None
+        self._l1.move_to_end(full_key)
+        return value
+
+    def _l1_set(self, full_key, value):
+        self._l1[full_key] = (time.time() + self.timeout, value)
+        self._l1.move_to_end(full_key)
+        while len(self._l1) > self.l1_size:
+            self._l1.popitem(last=False)
+
+
+fragment_cache = FragmentCache()
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Caches the block with `fragment_cache`. Usage:
+        {% cache 'month', 'calendar:' ~ user %}...{% endcache %}
+    The first expression is the fragment key, the rest ones are tags.
+    """
+
+    tags = set(['cache'])
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        tags = []
+        while parser.stream.skip_if('comma'):
+            tags.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        call = self.call_method('_cache', [key, nodes.List(tags)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cache(self, key, tags, caller):
+        return fragment_cache.get_or_render(key, tags, caller)
@@ -2,6 +2,7 @@ import logging
 
 from wtforms_tornado import Form as WTForm
 from schematics.exceptions import ValidationError as ModelValidationError
+from schematics.exceptions import ConversionError as ModelConversionError
 
 logger = logging.getLogger(__name__)
 
@@ -27,7 +28,45 @@ class Form(WTForm):
         return text_errors.get(err_code, err_code)
 
 
+class ValidationPlan(object):
+    """
+    Validation steps of a ModelForm class compiled against its model.
+    Every step is a tuple `(field_name, inline_validators, model_type)`:
+        inline_validators -- `validate_<field>` methods of the form
+        model_type -- schematics type of the same model field or None
+    `required` holds names of required model fields which have no form
+    field and no default, so they can never be filled by the form.
+    Model level `validate_<field>` methods need the whole model context,
+    so models which have them are not `compilable`.
+    """
+
+    def __init__(self, form_class, model, field_names):
+        self.model = model
+        self.compilable = not getattr(model, '_validator_functions', None)
+        self.steps = []
+        names = set(field_names)
+        for name in field_names:
+            inline = getattr(form_class, 'validate_{0}'.format(name), None)
+            self.steps.append((name,
+                               (inline,) if inline is not None else (),
+                               model._fields.get(name)))
+        self.required = [
+            name for name, model_type in model._fields.items()
+            if name not in names and model_type.required and
+            model_type.default is None]
+
+
 class ModelForm(Form):
+    """
+    Form which validates its data against the `_model` schematics model.
+    By default form is validated by WTForms and then the populated model
+    instance is validated by schematics. With `_compiled = True` both
+    validations are merged into one pass over the plan compiled once per
+    form class and the model instance is built from already converted data.
+    """
+
+    _compiled = False
+
     def __init__(self, *args, **kwargs):
         super(ModelForm, self).__init__(*args, **kwargs)
         self._model_object = None
@@ -41,7 +80,22 @@ class ModelForm(Form):
             raise EmptyException()
         return model
 
+    @classmethod
+    def get_validation_plan(cls, field_names):
+        plan = cls.__dict__.get('_validation_plan')
+        if plan is None:
+            model = getattr(cls, '_model', None)
+            if model is None:
+                raise EmptyException()
+            plan = ValidationPlan(cls, model, field_names)
+            cls._validation_plan = plan
+        return plan
+
     def validate(self):
+        if self._compiled:
+            plan = self.get_validation_plan(list(self._fields.keys()))
+            if plan.compilable:
+                return self._validate_compiled(plan)
         valid = super(ModelForm, self).validate()
         model = self.get_model()
         obj = model()
@@ -60,3 +114,43 @@ class ModelForm(Form):
             return False
         self._model_object = obj
         return valid
+
+    def _validate_compiled(self, plan):
+        self._errors = None
+        valid = True
+        data = {}
+        for name, inline, model_type in plan.steps:
+            field = self._fields[name]
+            if not field.validate(self, inline):
+                valid = False
+                continue
+            value = field.data
+            if model_type is None:
+                # Same as `populate_obj`, form-only data is kept on object
+                data[name] = value
+                continue
+            try:
+                if value is None:
+                    if model_type.required:
+                        raise ModelValidationError(
+                            model_type.messages['required'])
+                else:
+                    value = model_type.to_native(value)
+                    model_type.validate(value)
+            except (ModelConversionError, ModelValidationError) as e:
+                field.errors.extend(e.messages)
+                valid = False
+                continue
+            data[name] = value
+        for name in plan.required:
+            logger.warning('Required field "{0}" of {1} is not in form.'
+                           .format(name, plan.model.__name__))
+            self.set_nonfield_error('Unknown error.')
+            valid = False
+        if not valid:
+            return False
+        obj = plan.model()
+        for name, value in data.items():
+            setattr(obj, name, value)
+        self._model_object = obj
+        return True
@@ -1,19 +1,66 @@
 import json
 import logging
+import re
+import uuid
+from functools import partial
 
-from tornado.web import RequestHandler
+from motor.web import GridFSHandler
+from tornado.web import RequestHandler, StaticFileHandler
 from tornado import gen
+from tornado.stack_context import StackContext
 import tornado.escape
 from pycket.session import SessionMixin
 
+from .log import RequestContext
+from .utils import authenticated, json_default
+
 logger = logging.getLogger(__name__)
+# Client request ids are logged, so they are limited to safe ones
+REQUEST_ID_RE = re.compile(r'^[A-Za-z0-9-]{1,64}\Z')
 
 
 class BaseHandler(RequestHandler, SessionMixin):
     def __init__(self, application, request, **kwargs):
         self._current_user_object = None
+        self._admission = None
+        self._admitted = False
         super(BaseHandler, self).__init__(application, request, **kwargs)
 
+    def _execute(self, transforms, *args, **kwargs):
+        # Request id is set for all callbacks of the request, so log
+        # records of the request can be found by it
+        request_id = self.request.headers.get('X-Request-Id', '')
+        if not REQUEST_ID_RE.match(request_id):
+            request_id = uuid.uuid4().hex
+        self.request_id = request_id
+        self.set_header('X-Request-Id', self.request_id)
+        with StackContext(partial(RequestContext, self.request_id)):
+            return super(BaseHandler, self)._execute(transforms, *args,
+                                                     **kwargs)
+
+    def initialize(self, admission=None):
+        self._admission = admission
+
+    def prepare(self):
+        if (self._admission is None or
+                not self._admission.applies_to(self.request.method)):
+            return
+        rejection = self._admission.admit()
+        if rejection is None:
+            self._admitted = True
+            return
+        status_code, retry_after = rejection
+        logger.debug('Request to "{0}" is rejected with {1}'.format(
+            self._admission.name, status_code))
+        self.set_status(status_code)
+        self.set_header('Retry-After', retry_after)
+        self.finish()
+
+    def on_finish(self):
+        if self._admitted:
+            self._admitted = False
+            self._admission.release()
+
     def render_string(self, template_name, **context):
         context.update({
             'xsrf': self.xsrf_form_html,
@@ -40,7 +87,7 @@ class BaseHandler(RequestHandler, SessionMixin):
 
     def render_json(self, data):
         self.set_header('Content-Type', 'application/json')
-        self.write(json.dumps(data))
+        self.write(json.dumps(data, default=json_default))
 
     def get_current_user(self):
         return self.session.get('user', None)
@@ -57,6 +104,26 @@ class BaseHandler(RequestHandler, SessionMixin):
         raise gen.Return(self._current_user_object)
 
 
+class JobStatusHandler(BaseHandler):
+    @authenticated()
+    def get(self, job_id):
+        status = self.application.jobs.status(job_id)
+        if status is None or status['owner'] != self.current_user:
+            self.send_error(404)
+            return
+        self.render_json(status)
+
+
+class MediaFileHandler(GridFSHandler):
+    """
+    Serves generated media files from GridFS. Their names are derived from
+    the content, so they are cached by clients for the maximum time.
+    """
+
+    def get_cache_time(self, path, modified, mime_type):
+        return StaticFileHandler.CACHE_MAX_AGE
+
+
 class AuthMixin(object):
     def set_cookie(self, user):
         if user:
@@ -0,0 +1,350 @@
+"""
+Redis backed queue of jobs which are done by `invoke worker` processes
+out of the request path. Job is a function registered with `job` decorator,
+it is called as `func(worker, *args, **kwargs)` and its result must be
+JSON serializable.
+Example:
+    @job('examples.hello')
+    def hello(worker, name):
+        return 'Hello, {0}'.format(name)
+
+    job_id = job_queue.enqueue('examples.hello', ['Foo'])
+"""
+import json
+import logging
+import threading
+import time
+import traceback
+import uuid
+
+from .utils import json_default
+
+logger = logging.getLogger(__name__)
+_registry = {}
+
+HIGH = 'high'
+NORMAL = 'normal'
+LOW = 'low'
+PRIORITIES = (HIGH, NORMAL, LOW)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+RETRYING = 'retrying'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class JobFailed(Exception):
+    """
+    Raised by job to fail without retries.
+    """
+
+
+def job(name, max_retries=3, backoff=10):
+    """
+    Registers job function. Failed job is retried up to `max_retries` times
+    with `backoff * 2 ** attempt` seconds delay.
+    """
+    def decorator(func):
+        func.job_name = name
+        func.max_retries = max_retries
+        func.backoff = backoff
+        _registry[name] = func
+        return func
+    return decorator
+
+
+class JobQueue(object):
+    """
+    Job ids are stored in list per priority, delayed jobs (retries) in
+    sorted set by ready time and job data in hash per job.
+    Popped job id is atomically moved to the processing list of the worker
+    and stays there until the job is finished. Worker holds a lease which is
+    renewed while it is alive, jobs of the workers with expired leases are
+    queued again.
+    """
+
+    def __init__(self, redis=None, prefix='jobs', result_ttl=24 * 60 * 60):
+        self.redis = redis
+        self.prefix = prefix
+        self.result_ttl = result_ttl
+
+    def configure(self, redis, prefix=None, result_ttl=None):
+        self.redis = redis
+        self.prefix = prefix or self.prefix
+        self.result_ttl = result_ttl or self.result_ttl
+
+    def _key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def _job_key(self, job_id):
+        return self._key('job', job_id)
+
+    def enqueue(self, name, args=(), kwargs=None, priority=NORMAL,
+                owner=None):
+        """
+        Returns id of the queued job. `owner` is the user allowed to see
+        the job status.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError('Unknown priority "{0}".'.format(priority))
+        job_id = uuid.uuid4().hex
+        pipe = self.redis.pipeline()
+        pipe.hmset(self._job_key(job_id), {
+            'name': name,
+            'args': json.dumps(list(args), default=json_default),
+            'kwargs': json.dumps(kwargs or {}, default=json_default),
+            'priority': priority,
+            'owner': owner or '',
+            'status': QUEUED,
+            'attempts': 0,
+            'created_at': time.time(),
+        })
+        pipe.lpush(self._key('queue', priority), job_id)
+        pipe.execute()
+        return job_id
+
+    def status(self, job_id):
+        """
+        Returns dict with `status`, `result`, `error`, `attempts` and
+        `owner` of the job or None if there is no such job.
+        """
+        data = self.redis.hgetall(self._job_key(job_id))
+        if not data:
+            return None
+        data = dict((k.decode('utf-8'), v.decode('utf-8'))
+                    for k, v in data.items())
+        return {
+            'id': job_id,
+            'name': data['name'],
+            'status': data['status'],
+            'attempts': int(data['attempts']),
+            'owner': data['owner'] or None,
+            'result': json.loads(data['result']) if 'result' in data
+            else None,
+            'error': data.get('error'),
+        }
+
+    def promote_delayed(self):
+        """
+        Moves delayed jobs which are ready to their queues.
+        """
+        delayed_key = self._key('delayed')
+        for job_id in self.redis.zrangebyscore(delayed_key, 0, time.time()):
+            # Only the worker which removed the job queues it
+            if self.redis.zrem(delayed_key, job_id):
+                priority = self.redis.hget(self._job_key(job_id.decode()),
+                                           'priority')
+                self.redis.lpush(self._key('queue', priority.decode()),
+                                 job_id)
+
+    def renew_lease(self, worker_id, timeout):
+        """
+        Registers the worker or prolongs its lease for `timeout` seconds.
+        """
+        pipe = self.redis.pipeline()
+        pipe.sadd(self._key('workers'), worker_id)
+        pipe.setex(self._key('lease', worker_id), int(timeout), 1)
+        pipe.execute()
+
+    def release_lease(self, worker_id):
+        """
+        Expires the lease, so the unfinished job of the stopped worker is
+        queued again right away.
+        """
+        self.redis.delete(self._key('lease', worker_id))
+
+    def requeue_stale(self):
+        """
+        Queues again jobs left in processing lists of the workers with
+        expired leases. Jobs which have no retries left are failed, so a job
+        which kills its worker is not run forever. Returns ids of the queued
+        jobs.
+        """
+        workers_key = self._key('workers')
+        requeued = []
+        for worker_id in self.redis.smembers(workers_key):
+            worker_id = worker_id.decode()
+            if self.redis.exists(self._key('lease', worker_id)):
+                continue
+            # Only the worker which removed the stale one requeues its jobs
+            if not self.redis.srem(workers_key, worker_id):
+                continue
+            processing_key = self._key('processing', worker_id)
+            worker_requeued = []
+            while True:
+                job_id = self.redis.lindex(processing_key, -1)
+                if job_id is None:
+                    break
+                job_id = job_id.decode()
+                name, priority, attempts = self.redis.hmget(
+                    self._job_key(job_id), 'name', 'priority', 'attempts')
+                if priority is None:
+                    # Job data is expired, nothing to run
+                    self.redis.rpop(processing_key)
+                    continue
+                func = _registry.get(name.decode())
+                if int(attempts) > (func.max_retries if func else 0):
+                    logger.error('Job {0} ({1}) stopped worker {2}, no '
+                                 'retries left'.format(name.decode(), job_id,
+                                                       worker_id))
+                    self.fail(worker_id, job_id,
+                              'Worker stopped while running the job.')
+                    continue
+                self.redis.hset(self._job_key(job_id), 'status', QUEUED)
+                self.redis.rpoplpush(processing_key,
+                                     self._key('queue', priority.decode()))
+                worker_requeued.append(job_id)
+            if worker_requeued:
+                logger.warning('Jobs {0} of the stale worker {1} are '
+                               'queued again'.format(
+                                   ', '.join(worker_requeued), worker_id))
+            requeued.extend(worker_requeued)
+        return requeued
+
+    def pop(self, worker_id, timeout=1):
+        """
+        Returns `(job_id, job_data)` of the next job in priority order or
+        None if there is no job for `timeout` seconds. The job is kept in
+        the processing list of the worker until it's completed or failed.
+        """
+        self.promote_delayed()
+        self.requeue_stale()
+        processing_key = self._key('processing', worker_id)
+        # BRPOPLPUSH takes one list only, so it blocks on the lowest
+        # priority and the others are checked before it
+        job_id = None
+        for priority in PRIORITIES[:-1]:
+            job_id = self.redis.rpoplpush(self._key('queue', priority),
+                                          processing_key)
+            if job_id is not None:
+                break
+        else:
+            job_id = self.redis.brpoplpush(
+                self._key('queue', PRIORITIES[-1]), processing_key, timeout)
+        if job_id is None:
+            return None
+        job_id = job_id.decode()
+        data = self.redis.hgetall(self._job_key(job_id))
+        if not data:
+            self.redis.lrem(processing_key, 0, job_id)
+            return None
+        data = dict((k.decode('utf-8'), v.decode('utf-8'))
+                    for k, v in data.items())
+        data['attempts'] = int(data['attempts']) + 1
+        self.redis.hmset(self._job_key(job_id), {
+            'status': RUNNING,
+            'attempts': data['attempts'],
+        })
+        return job_id, data
+
+    def complete(self, worker_id, job_id, result):
+        pipe = self.redis.pipeline()
+        pipe.hmset(self._job_key(job_id), {
+            'status': DONE,
+            'result': json.dumps(result, default=json_default),
+        })
+        pipe.expire(self._job_key(job_id), self.result_ttl)
+        pipe.lrem(self._key('processing', worker_id), 0, job_id)
+        pipe.execute()
+
+    def fail(self, worker_id, job_id, error, retry_in=None):
+        """
+        Fails the job. If `retry_in` seconds is given the job is delayed.
+        """
+        pipe = self.redis.pipeline()
+        pipe.lrem(self._key('processing', worker_id), 0, job_id)
+        if retry_in is None:
+            pipe.hmset(self._job_key(job_id), {'status': FAILED,
+                                               'error': error})
+            pipe.expire(self._job_key(job_id), self.result_ttl)
+        else:
+            pipe.hmset(self._job_key(job_id), {'status': RETRYING,
+                                               'error': error})
+            pipe.zadd(self._key('delayed'), time.time() + retry_in, job_id)
+        pipe.execute()
+
+
+job_queue = JobQueue()
+
+
+class Worker(object):
+    """
+    Takes jobs from the queue and runs them one by one. `db` is sync
+    pymongo database for the jobs. The lease is renewed by a background
+    thread, so long jobs are not taken by other workers, `lease_timeout`
+    is how long jobs of the dead worker wait to be queued again.
+    `last_attempt` is set while job runs, so it can clean up when it's
+    not going to be retried.
+    """
+
+    def __init__(self, queue, db, poll_timeout=1, lease_timeout=30):
+        self.id = uuid.uuid4().hex
+        self.queue = queue
+        self.db = db
+        self.poll_timeout = poll_timeout
+        self.lease_timeout = lease_timeout
+        self.last_attempt = False
+        self._running = threading.Event()
+
+    def run(self):
+        self._running.set()
+        self.queue.renew_lease(self.id, self.lease_timeout)
+        heartbeat = threading.Thread(target=self._heartbeat)
+        heartbeat.daemon = True
+        heartbeat.start()
+        logger.info('Worker {0} is started, jobs: {1}'.format(
+            self.id, ', '.join(sorted(_registry))))
+        try:
+            while self._running.is_set():
+                item = self.queue.pop(self.id, self.poll_timeout)
+                if item is not None:
+                    self.run_job(*item)
+        finally:
+            self._running.clear()
+            self.queue.release_lease(self.id)
+
+    def stop(self):
+        self._running.clear()
+
+    def _heartbeat(self):
+        interval = self.lease_timeout / 3.0
+        while self._running.is_set():
+            try:
+                self.queue.renew_lease(self.id, self.lease_timeout)
+            except Exception:
+                logger.exception('Lease of worker {0} is not renewed'.format(
+                    self.id))
+            time.sleep(interval)
+
+    def run_job(self, job_id, data):
+        func = _registry.get(data['name'])
+        if func is None:
+            logger.error('Unknown job "{0}" ({1})'.format(data['name'],
+                                                          job_id))
+            self.queue.fail(self.id, job_id, 'Unknown job.')
+            return
+        started = time.time()
+        self.last_attempt = data['attempts'] > func.max_retries
+        try:
+            result = func(self, *json.loads(data['args']),
+                          **json.loads(data['kwargs']))
+        except JobFailed as e:
+            logger.warning('Job {0} ({1}) failed: {2}'.format(
+                data['name'], job_id, e))
+            self.queue.fail(self.id, job_id, str(e))
+        except Exception as e:
+            attempt = data['attempts']
+            retry_in = None
+            if attempt <= func.max_retries:
+                retry_in = func.backoff * 2 ** (attempt - 1)
+            logger.exception('Job {0} ({1}) failed, attempt {2}, {3}'.format(
+                data['name'], job_id, attempt,
+                'no retries left' if retry_in is None
+                else 'retry in {0}s'.format(retry_in)))
+            self.queue.fail(self.id, job_id, traceback.format_exception_only(
+                type(e), e)[-1].strip(), retry_in)
+        else:
+            logger.info('Job {0} ({1}) is done in {2:.3f}s'.format(
+                data['name'], job_id, time.time() - started))
+            self.queue.complete(self.id, job_id, result)
@@ -0,0 +1,175 @@
+"""
+Non-blocking logging pipeline. Records are put to the in-memory queue by
+`DroppingQueueHandler` and written by `SinkListener` thread through the
+handlers of the sink logger, so slow disk never blocks the IOLoop.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from .admission import TokenBucket
+
+SINK_LOGGER = 'calendio.sink'
+
+
+class RequestContext(object):
+    """
+    Context for `tornado.stack_context.StackContext` which makes request id
+    available to log records of all the request callbacks.
+    """
+
+    _local = threading.local()
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self._previous = None
+
+    def __enter__(self):
+        self._previous = self.current_request_id()
+        self._local.request_id = self.request_id
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._local.request_id = self._previous
+
+    @classmethod
+    def current_request_id(cls):
+        return getattr(cls._local, 'request_id', None)
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = RequestContext.current_request_id()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Passes only `rate` part of records up to `max_level`.
+    """
+
+    def __init__(self, rate=1.0, max_level=logging.DEBUG):
+        super(SamplingFilter, self).__init__()
+        self.rate = rate
+        self.max_level = max_level
+
+    def filter(self, record):
+        return record.levelno > self.max_level or random.random() < self.rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Limits records up to `max_level` from the same line of code to `rate`
+    per second with `burst`. Number of suppressed records is added to the
+    next passed one as `suppressed` attribute.
+    """
+
+    def __init__(self, rate=10, burst=50, max_level=logging.WARNING):
+        super(RateLimitFilter, self).__init__()
+        self.rate = rate
+        self.burst = burst
+        self.max_level = max_level
+        self._buckets = {}
+        self._suppressed = {}
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.burst)
+        if bucket.consume():
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return False
+        record.suppressed = self._suppressed.pop(key, 0)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Puts records to the bounded queue, records are dropped and counted in
+    `dropped` when the queue is full.
+    """
+
+    def __init__(self, maxsize=10000):
+        super(DroppingQueueHandler, self).__init__(queue.Queue(maxsize))
+        self.dropped = 0
+        self._exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Unlike the default one, traceback is kept apart from the message
+        # in `exc_text`, so sink formatters can put it to their own field
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exc_formatter.formatException(
+                    record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class SinkListener(QueueListener):
+    """
+    Passes records from the queue to the sink logger handlers and reports
+    records dropped by the queue handler.
+    """
+
+    def __init__(self, queue_handler, sink_name=SINK_LOGGER):
+        super(SinkListener, self).__init__(queue_handler.queue)
+        self.queue_handler = queue_handler
+        self.sink = logging.getLogger(sink_name)
+        self._reported_dropped = 0
+
+    def handle(self, record):
+        self.sink.handle(self.prepare(record))
+        dropped = self.queue_handler.dropped
+        if dropped != self._reported_dropped:
+            self.sink.warning('Log queue is full, {0} records are dropped '
+                              '(total {1})'.format(
+                                  dropped - self._reported_dropped, dropped))
+            self._reported_dropped = dropped
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record, self.datefmt),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'source': '{0}:{1}'.format(record.filename, record.lineno),
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            data['suppressed'] = suppressed
+        if record.exc_text:
+            data['exc'] = record.exc_text
+        elif record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+def start_listeners(logger_name=''):
+    """
+    Starts listener threads for queue handlers of the logger. They are
+    stopped, so the queues are flushed, at exit.
+    """
+    for handler in logging.getLogger(logger_name).handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            listener = SinkListener(handler)
+            listener.start()
+            atexit.register(listener.stop)
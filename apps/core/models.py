@@ -134,6 +134,47 @@ class BaseModel(Model):
         if result:
             self._id = result
 
+    @classmethod
+    @gen.coroutine
+    def bulk_update(cls, db, updates, collection=None, upsert=False):
+        """
+        Runs list of `(query, update)` pairs with one unordered bulk request,
+        every update is applied to one document.
+        Example:
+            yield ExampleModel.bulk_update(self.db, [
+                ({"_id": 1}, {"$set": {"first_name": "Foo"}}),
+                ({"_id": 2}, {"$set": {"first_name": "Bar"}}),
+            ], upsert=True)
+        """
+        if not updates:
+            return
+        c = cls.check_collection(collection)
+        bulk = db[c].initialize_unordered_bulk_op()
+        for query, update in updates:
+            operation = bulk.find(cls.process_query(query))
+            if upsert:
+                operation = operation.upsert()
+            operation.update_one(update)
+        result = yield motor.Op(bulk.execute)
+        raise gen.Return(result)
+
+    @classmethod
+    @gen.coroutine
+    def find_and_modify(cls, db, query, update, collection=None,
+                        upsert=False, new=True, fields=None):
+        """
+        Updates one document atomically and returns it as dict, the updated
+        one by default.
+        Example:
+            counter = yield ExampleModel.find_and_modify(
+                self.db, {"_id": 1}, {"$inc": {"value": 1}}, upsert=True)
+        """
+        c = cls.check_collection(collection)
+        result = yield motor.Op(db[c].find_and_modify,
+                                cls.process_query(query), update,
+                                upsert=upsert, new=new, fields=fields)
+        raise gen.Return(result)
+
     @gen.coroutine
     def update(self, db=None, query=None, collection=None, update=None,
                ser=None, upsert=False, multi=False):
@@ -1,7 +1,10 @@
+import datetime
 import hashlib
 import uuid
 from functools import wraps
 
+from bson.objectid import ObjectId
+
 
 def make_pass(password):
     salt = uuid.uuid4().hex
@@ -39,3 +42,14 @@ def authenticated(redirect_to='login'):
                 return func(self, *args, **kwargs)
         return wrapper
     return decorator
+
+
+def json_default(obj):
+    """
+    `default` for `json.dumps` to serialize DB documents.
+    """
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError('{0!r} is not JSON serializable'.format(obj))
@@ -1,5 +1,24 @@
+from wtforms import StringField, TextAreaField, DateTimeField, validators
+from wtforms.validators import ValidationError
+
 from ..core.forms import ModelForm
+from .models import Event
 
 
 class EventForm(ModelForm):
-    pass
+    title = StringField('Title', [validators.InputRequired()])
+    description = TextAreaField('Description')
+    location = StringField('Location')
+    starts_at = DateTimeField('Starts at', [validators.InputRequired()])
+    ends_at = DateTimeField('Ends at', [validators.Optional()])
+
+    _model = Event
+    _compiled = True
+    text_errors = {
+        'ends_before_start': 'Event cannot end before it starts.',
+    }
+
+    def validate_ends_at(self, field):
+        if (field.data and self.starts_at.data and
+                field.data < self.starts_at.data):
+            raise ValidationError(self.text_errors['ends_before_start'])
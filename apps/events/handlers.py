@@ -1,10 +1,20 @@
+import json
 import logging
+from datetime import datetime, timedelta
 
+import msgpack
+from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from tornado import gen
-from tornado.websocket import WebSocketHandler
+from tornado.ioloop import IOLoop
+from tornado.websocket import WebSocketHandler, WebSocketClosedError
+from pycket.session import SessionMixin
 
 from ..core.handlers import BaseHandler, AuthMixin
-from ..core.utils import authenticated
+from ..core.utils import authenticated, json_default
+from .models import Event, EventChangeLog, FeedEntry
+from .notifications import subscribe, unsubscribe
+from .search import prefix_indexes
 
 logger = logging.getLogger(__name__)
 
@@ -15,20 +25,234 @@ class EventsHandler(BaseHandler, AuthMixin):
         self.render('events/events.html')
 
 
-class EventsWebSocketHandler(WebSocketHandler):
-    """Tornado Websocket Handler."""
+class EventsSearchHandler(BaseHandler):
+    @gen.coroutine
+    @authenticated()
+    def get(self):
+        text = self.get_argument('q', '').strip()
+        events = []
+        if text:
+            events = yield Event.search(self.db, self.current_user, text)
+        self.render_json({'events': events})
+
+
+class EventsAutocompleteHandler(BaseHandler):
+    @gen.coroutine
+    @authenticated()
+    def get(self):
+        index = yield prefix_indexes.get(self.db, self.current_user)
+        suggestions = index.complete(self.get_argument('q', ''))
+        self.render_json({'suggestions': [
+            {'id': event_id, 'title': title}
+            for event_id, title in suggestions]})
+
+
+class EventsSyncHandler(BaseHandler):
+    """
+    Returns user events changed since the `token`. Without token or if
+    the token is expired all events are returned with `full` flag by pages
+    of `FULL_SYNC_PAGE_LEN` events: response has `page` to be passed to get
+    the next one instead of `token`, the last page has `token`.
+    Response `token` is to be passed with the next request.
+    """
+
+    FULL_SYNC_PAGE_LEN = 1000
+
+    @gen.coroutine
+    @authenticated()
+    def get(self):
+        page = self.get_argument('page', None)
+        if page is not None:
+            try:
+                seq, after_id = page.split(':')
+                seq, after_id = int(seq), ObjectId(after_id)
+            except (ValueError, InvalidId):
+                self.send_error(400)
+                return
+            response = yield self._full_sync(seq, after_id)
+            self.render_json(response)
+            return
+        try:
+            seq = int(self.get_argument('token', ''))
+        except ValueError:
+            seq = None
+        result = None
+        if seq is not None:
+            result = yield EventChangeLog.changes_since(
+                self.db, self.current_user, seq)
+        if result is None:
+            # Token is taken before events, so concurrent changes are resent
+            seq = yield EventChangeLog.current_seq(self.db, self.current_user)
+            response = yield self._full_sync(seq)
+        else:
+            response = yield self._delta_sync(*result)
+        self.render_json(response)
+
+    @gen.coroutine
+    def _full_sync(self, seq, after_id=None):
+        query = Event.user_query(self.current_user)
+        if after_id is not None:
+            query['_id'] = {'$gt': after_id}
+        cursor = Event.get_cursor(self.db, query).sort('_id', 1)
+        events = yield Event.find(cursor, model=False,
+                                  list_len=self.FULL_SYNC_PAGE_LEN + 1)
+        response = {
+            'full': True,
+            'events': events[:self.FULL_SYNC_PAGE_LEN],
+            'deleted': [],
+        }
+        if len(events) > self.FULL_SYNC_PAGE_LEN:
+            response['page'] = '{0}:{1}'.format(
+                seq, events[self.FULL_SYNC_PAGE_LEN - 1]['_id'])
+        else:
+            response['token'] = str(seq)
+        raise gen.Return(response)
+
+    @gen.coroutine
+    def _delta_sync(self, seq, changes):
+        last_ops = {}
+        for change in changes:
+            last_ops[change['event_id']] = change['op']
+        put_ids = [event_id for event_id, op in last_ops.items()
+                   if op == EventChangeLog.PUT]
+        events = []
+        if put_ids:
+            # Events the user has no access to anymore are deleted
+            query = Event.user_query(self.current_user)
+            query['_id'] = {'$in': put_ids}
+            cursor = Event.get_cursor(self.db, query)
+            events = yield Event.find(cursor, model=False,
+                                      list_len=len(put_ids))
+        found_ids = set(event['_id'] for event in events)
+        raise gen.Return({
+            'token': str(seq),
+            'full': False,
+            'events': events,
+            # Events removed after the change was logged are deleted too
+            'deleted': [event_id for event_id in last_ops
+                        if event_id not in found_ids],
+        })
+
+
+class EventsFeedHandler(BaseHandler):
+    """
+    Returns calendar feed of the user overlapping `[start, end)` window,
+    dates are in `DATE_FORMAT`. Window is the week from today by default.
+    """
+
+    DATE_FORMAT = '%Y-%m-%d'
+
+    @gen.coroutine
+    @authenticated()
+    def get(self):
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        try:
+            start = self._get_date('start', today)
+            end = self._get_date('end', start + timedelta(days=7))
+        except ValueError:
+            self.send_error(400)
+            return
+        entries = yield FeedEntry.window(self.db, self.current_user,
+                                         start, end)
+        self.render_json({'entries': entries})
+
+    def _get_date(self, name, default):
+        value = self.get_argument(name, None)
+        if value is None:
+            return default
+        return datetime.strptime(value, self.DATE_FORMAT)
+
+
+class InvitationHandler(BaseHandler):
+    @gen.coroutine
+    @authenticated()
+    def post(self, event_id):
+        status = self.get_argument('status', '')
+        try:
+            event_id = ObjectId(event_id)
+        except InvalidId:
+            event_id = None
+        if event_id is None or status not in FeedEntry.STATUSES:
+            self.send_error(400)
+            return
+        invited = yield FeedEntry.respond(self.db, self.current_user,
+                                          event_id, status)
+        if not invited:
+            self.send_error(404)
+            return
+        self.render_json({'event_id': event_id, 'status': status})
+
+
+class EventsWebSocketHandler(WebSocketHandler, SessionMixin):
+    """
+    Pushes live event updates. Updates are coalesced per connection for
+    `COALESCE_DELAY` seconds (or `MAX_BATCH` updates) and sent as one frame
+    `{"updates": [...]}`. Frames are msgpack encoded binary ones if client
+    requests `MSGPACK_PROTOCOL` subprotocol and JSON text ones otherwise.
+    Update `seq` is the sync token of the change, see `EventChangeLog`.
+    """
+
+    JSON_PROTOCOL = 'calendio.json'
+    MSGPACK_PROTOCOL = 'calendio.msgpack'
+    COALESCE_DELAY = 0.05  # sec
+    MAX_BATCH = 500
+
+    def initialize(self):
+        self._binary = False
+        self._pending = []
+        self._flush_timeout = None
+
+    def get_current_user(self):
+        return self.session.get('user', None)
+
+    def get_compression_options(self):
+        # Enables permessage-deflate with default options
+        return {}
 
-    def check_origin(self, origin):
-        return True
+    def select_subprotocol(self, subprotocols):
+        for protocol in (self.MSGPACK_PROTOCOL, self.JSON_PROTOCOL):
+            if protocol in subprotocols:
+                self._binary = protocol == self.MSGPACK_PROTOCOL
+                return protocol
+        return None
 
     def open(self):
-        pass
+        if not self.current_user:
+            self.close()
+            return
+        subscribe(self.current_user, self)
 
     def on_close(self):
-        pass
+        if self.current_user:
+            unsubscribe(self.current_user, self)
+        if self._flush_timeout is not None:
+            IOLoop.current().remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+        self._pending = []
 
+    def queue_update(self, update):
+        self._pending.append(update)
+        if len(self._pending) >= self.MAX_BATCH:
+            self.flush()
+        elif self._flush_timeout is None:
+            self._flush_timeout = IOLoop.current().call_later(
+                self.COALESCE_DELAY, self.flush)
 
-@gen.coroutine
-def send_event_notification():
-    while True:
-        pass
+    def flush(self):
+        if self._flush_timeout is not None:
+            IOLoop.current().remove_timeout(self._flush_timeout)
+            self._flush_timeout = None
+        if not self._pending:
+            return
+        data = {'updates': self._pending}
+        self._pending = []
+        if self._binary:
+            message = msgpack.packb(data, default=json_default,
+                                    use_bin_type=True)
+        else:
+            message = json.dumps(data, default=json_default)
+        try:
+            self.write_message(message, binary=self._binary)
+        except WebSocketClosedError:
+            logger.debug('Updates to closed connection of {0} are lost'
+                         .format(self.current_user))
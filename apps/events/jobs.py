@@ -0,0 +1,87 @@
+import logging
+from datetime import datetime
+
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from ..core.cache import fragment_cache
+from ..core.jobs import job
+from .models import Event, EventChangeLog, FeedEntry
+from .notifications import send_event_notifications
+
+logger = logging.getLogger(__name__)
+
+
+@job('events.fan_out')
+def fan_out(worker, event_id, version, deleted):
+    """
+    Records changes of the event `version` to the logs of its participants
+    and writes their feed entries by chunks, `deleted` are the users whose
+    changes are deletions (removed attendees or all the participants of
+    removed event). Every chunk is written from the stored event. When a
+    newer version is written its fan-out takes over: this one stops and
+    removes entries of its last chunk for users who are not attendees
+    anymore. Entries are upserted, so failed job is retried from the start,
+    changes may be logged twice then.
+    """
+    event_id = ObjectId(event_id)
+    events = worker.db[Event.MONGO_COLLECTION]
+    feeds = worker.db[FeedEntry.MONGO_COLLECTION]
+    for offset in range(0, len(deleted), FeedEntry.FANOUT_CHUNK):
+        _record_changes(worker.db, event_id, dict(
+            (user, EventChangeLog.DELETE)
+            for user in deleted[offset:offset + FeedEntry.FANOUT_CHUNK]))
+    offset = 0
+    chunk = []
+    while True:
+        data = events.find_one({'_id': event_id})
+        event = Event.make_model(data, 'fan_out') if data else None
+        if event is None or event.version != version:
+            stale = set(chunk).difference(
+                event.participants() if event is not None else ())
+            if stale:
+                feeds.remove({'event_id': event_id,
+                              'user': {'$in': list(stale)}})
+            logger.debug('Fan-out of event {0} v{1} is superseded'.format(
+                event_id, version))
+            return {'users': offset, 'superseded': True}
+        chunk = event.participants()[offset:offset + FeedEntry.FANOUT_CHUNK]
+        if not chunk:
+            break
+        attendees = event.attendees[offset:offset + FeedEntry.FANOUT_CHUNK]
+        if event.fanout and attendees:
+            bulk = feeds.initialize_unordered_bulk_op()
+            for query, update in FeedEntry.entry_updates(
+                    event, attendees, FeedEntry.ATTENDEE):
+                bulk.find(query).upsert().update_one(update)
+            bulk.execute()
+        _record_changes(worker.db, event_id, dict(
+            (user, EventChangeLog.PUT) for user in chunk))
+        # Calendars could be cached before the entries are written
+        fragment_cache.invalidate(*['calendar:{0}'.format(user)
+                                    for user in chunk])
+        offset += len(chunk)
+    logger.debug('Event {0} v{1} is fanned out to {2} users'.format(
+        event_id, version, offset))
+    return {'users': offset, 'superseded': False}
+
+
+def _record_changes(db, event_id, users):
+    """
+    Same as `EventChangeLog.record` with sync pymongo database.
+    """
+    logs = db[EventChangeLog.MONGO_COLLECTION]
+    now = datetime.utcnow()
+    updates = []
+    for user, op in users.items():
+        update = EventChangeLog.change_update(event_id, op, now)
+        try:
+            log = logs.find_and_modify({'user': user}, update, upsert=True,
+                                       new=True, fields={'seq': True})
+        except DuplicateKeyError:
+            # Log of the user is created by concurrent write, it exists now
+            log = logs.find_and_modify({'user': user}, update, new=True,
+                                       fields={'seq': True})
+        updates.append((user, {'event_id': event_id, 'op': op,
+                               'seq': log['seq']}))
+    send_event_notifications(updates)
@@ -1,5 +1,409 @@
+import logging
+from datetime import datetime, timedelta
+
+from tornado import gen
+from schematics.types import (BaseType, StringType, EmailType,
+                              DateTimeType, IntType, NumberType, BooleanType)
+from schematics.types.compound import ListType
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+from ..core.cache import fragment_cache
+from ..core.jobs import job_queue
 from ..core.models import BaseModel
+from .notifications import send_event_notifications
+from .search import prefix_indexes
+
+logger = logging.getLogger(__name__)
 
 
 class Event(BaseModel):
-    pass
+    title = StringType(required=True, max_length=200)
+    description = StringType(default='', max_length=5000)
+    location = StringType(default='', max_length=200)
+    starts_at = DateTimeType(required=True)
+    ends_at = DateTimeType(default=None)
+    owner = EmailType(default=None)
+    attendees = ListType(EmailType(), default=list)
+    # False if attendees feeds are not materialized, see `FeedEntry`
+    fanout = BooleanType(default=True)
+    # Incremented by every write, background fan-out stops on a newer one
+    version = IntType(default=0)
+    # Longer than `FeedEntry.LONG_DURATION`, see `FeedEntry.window`
+    long_event = BooleanType(default=False)
+
+    MONGO_COLLECTION = 'events'
+    NEED_SYNC = True
+    INDEXES = (
+        {'name': [('owner', 1), ('starts_at', 1)]},
+        {'name': [('attendees', 1), ('fanout', 1), ('starts_at', 1)]},
+        {'name': [('attendees', 1), ('fanout', 1), ('long_event', 1),
+                  ('ends_at', 1)]},
+        {'name': [('title', 'text'), ('description', 'text'),
+                  ('location', 'text'), ('attendees', 'text')],
+         'weights': {'title': 10, 'location': 5, 'attendees': 5}},
+    )
+    SEARCH_LIST_LEN = 50
+
+    def __init__(self, *args, **kwargs):
+        super(Event, self).__init__(*args, **kwargs)
+        # Participants as they are stored in DB, to find who lost the event
+        self._stored_participants = set(self.participants())
+
+    @staticmethod
+    def user_query(user):
+        """
+        Query for events the user owns or attends.
+        """
+        return {'$or': [{'owner': user}, {'attendees': user}]}
+
+    def participants(self):
+        users = list(self.attendees or ())
+        if self.owner:
+            users.append(self.owner)
+        return users
+
+    @classmethod
+    @gen.coroutine
+    def search(cls, db, user, text, collection=None):
+        """
+        Full text search over user events, the most relevant go first.
+        Returns list of dicts with `score` key.
+        """
+        query = cls.user_query(user)
+        query['$text'] = {'$search': text}
+        score = {'score': {'$meta': 'textScore'}}
+        cursor = cls.get_cursor(db, query, collection, fields=score).sort(
+            [('score', {'$meta': 'textScore'})])
+        result = yield cls.find(cursor, model=False,
+                                list_len=cls.SEARCH_LIST_LEN)
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def insert(self, db=None, *args, **kwargs):
+        yield super(Event, self).insert(db, *args, **kwargs)
+        prefix_indexes.index_event(self)
+        yield self.written(db or self.db, EventChangeLog.PUT)
+
+    @gen.coroutine
+    def save(self, db=None, *args, **kwargs):
+        yield super(Event, self).save(db, *args, **kwargs)
+        prefix_indexes.index_event(self)
+        yield self.written(db or self.db, EventChangeLog.PUT)
+
+    @gen.coroutine
+    def update(self, db=None, query=None, collection=None, update=None,
+               **kwargs):
+        result = yield super(Event, self).update(db, query, collection,
+                                                 update, **kwargs)
+        if query is None and update is None:
+            prefix_indexes.index_event(self)
+        else:
+            # Stored data may differ from the object one
+            prefix_indexes.invalidate(self.participants())
+        if query is None:
+            yield self.written(db or self.db, EventChangeLog.PUT)
+        else:
+            logger.warning('Event update by query is not in change log: '
+                           '{0}'.format(query))
+        raise gen.Return(result)
+
+    @gen.coroutine
+    def remove(self, db, *args, **kwargs):
+        yield super(Event, self).remove(db, *args, **kwargs)
+        prefix_indexes.remove_event(self.pk)
+        yield self.written(db, EventChangeLog.DELETE)
+
+    def get_data_for_save(self, ser):
+        self.fanout = len(self.attendees or ()) <= FeedEntry.FANOUT_MAX
+        self.long_event = FeedEntry.is_long(self.starts_at, self.ends_at)
+        self.version = (self.version or 0) + 1
+        return super(Event, self).get_data_for_save(ser)
+
+    @gen.coroutine
+    def written(self, db, op):
+        """
+        Called after the event is written to DB. Changes of events with more
+        than `FeedEntry.FANOUT_BACKGROUND` users are recorded by
+        `events.fan_out` job with their feed entries.
+        """
+        users = EventChangeLog.user_ops(self, op)
+        if len(users) <= FeedEntry.FANOUT_BACKGROUND:
+            yield EventChangeLog.record(db, self.pk, users)
+        else:
+            from .jobs import fan_out
+
+            job_queue.enqueue(fan_out.job_name, [
+                self.pk, self.version,
+                [user for user, user_op in users.items()
+                 if user_op == EventChangeLog.DELETE]])
+        yield FeedEntry.fan_out(db, self, op)
+        fragment_cache.invalidate(*['calendar:{0}'.format(user)
+                                    for user in users])
+        self._stored_participants = set(self.participants())
+
+
+class EventChangeLog(BaseModel):
+    """
+    Change log of user events. Every event write appends a change to the
+    log of each affected user and increments its `seq` with one atomic
+    update, so `seq` is the number of changes ever written and works as a
+    sync token without gaps. Only the last `MAX_CHANGES` changes are kept:
+    change `i` of `changes` has seq `seq - len(changes) + i + 1`, tokens
+    older than the first kept change require full resync.
+    """
+
+    user = EmailType(required=True)
+    seq = IntType(default=0)
+    changes = BaseType(default=list)
+
+    PUT = 'put'
+    DELETE = 'delete'
+    MAX_CHANGES = 1000
+
+    MONGO_COLLECTION = 'event_change_logs'
+    NEED_SYNC = True
+    INDEXES = (
+        {'name': 'user', 'unique': True},
+    )
+
+    @classmethod
+    def user_ops(cls, event, op):
+        """
+        Returns `{user: op}` of the users whose calendars are changed by
+        the event write.
+        """
+        users = dict((user, op) for user in event.participants())
+        for user in event._stored_participants.difference(users):
+            # User is removed from attendees
+            users[user] = cls.DELETE
+        return users
+
+    @classmethod
+    def change_update(cls, event_id, op, at):
+        return {'$inc': {'seq': 1},
+                '$push': {'changes': {
+                    '$each': [{'event_id': event_id, 'op': op, 'at': at}],
+                    '$slice': -cls.MAX_CHANGES}}}
+
+    @classmethod
+    @gen.coroutine
+    def record(cls, db, event_id, users):
+        """
+        Appends the event change to the logs of `users` (`{user: op}`) and
+        pushes it to their connections with `seq` of the change, which is
+        the sync token the update brings client to. Logs are updated by
+        concurrent requests, one per user.
+        """
+        if not users:
+            return
+        now = datetime.utcnow()
+        seqs = yield dict(
+            (user, cls._append(db, user, cls.change_update(event_id, user_op,
+                                                           now)))
+            for user, user_op in users.items())
+        send_event_notifications([
+            (user, {'event_id': event_id, 'op': user_op, 'seq': seqs[user]})
+            for user, user_op in users.items()])
+
+    @classmethod
+    @gen.coroutine
+    def _append(cls, db, user, update):
+        try:
+            log = yield cls.find_and_modify(db, {'user': user}, update,
+                                            upsert=True, fields={'seq': True})
+        except DuplicateKeyError:
+            # Log of the user is created by concurrent write, it exists now
+            log = yield cls.find_and_modify(db, {'user': user}, update,
+                                            fields={'seq': True})
+        raise gen.Return(log['seq'])
+
+    @classmethod
+    @gen.coroutine
+    def current_seq(cls, db, user):
+        log = yield cls.find_one(db, {'user': user}, model=False)
+        raise gen.Return(log['seq'] if log else 0)
+
+    @classmethod
+    @gen.coroutine
+    def changes_since(cls, db, user, seq):
+        """
+        Returns `(last_seq, changes)` where changes are the ones after
+        `seq` ordered by seq or None if some of them are not kept already.
+        """
+        log = yield cls.find_one(db, {'user': user}, model=False)
+        last_seq, changes = (log['seq'], log['changes']) if log else (0, [])
+        first_seq = last_seq - len(changes) + 1
+        if seq > last_seq or seq + 1 < first_seq:
+            raise gen.Return(None)
+        raise gen.Return((last_seq, changes[seq + 1 - first_seq:]))
+
+
+class FeedEntry(BaseModel):
+    """
+    Event in the calendar feed of a user, the owner or an invited attendee.
+    Entries are written with the event, so calendar of a user is read by
+    one index scan. Events with more than `FANOUT_MAX` attendees have
+    only owner entry and the entries of attendees who responded, the rest
+    attendees get them merged at read time. Entries of events with more
+    than `FANOUT_BACKGROUND` attendees are written by `events.fan_out` job.
+    """
+
+    user = EmailType(required=True)
+    event_id = NumberType(number_class=ObjectId, number_type="ObjectId")
+    title = StringType(default='')
+    starts_at = DateTimeType(required=True)
+    ends_at = DateTimeType(default=None)
+    # End of the event for window queries, `starts_at` if it has no end
+    until = DateTimeType(required=True)
+    long_event = BooleanType(default=False)
+    role = StringType(required=True)
+    status = StringType(required=True)
+
+    OWNER = 'owner'
+    ATTENDEE = 'attendee'
+    PENDING = 'pending'
+    ACCEPTED = 'accepted'
+    DECLINED = 'declined'
+    STATUSES = (PENDING, ACCEPTED, DECLINED)
+    FANOUT_BACKGROUND = 100
+    FANOUT_MAX = 5000
+    FANOUT_CHUNK = 1000
+    # Window scans start this time before the window, longer events are
+    # marked and found by their end
+    LONG_DURATION = timedelta(days=31)
+    FIND_LIST_LEN = 1000
+
+    MONGO_COLLECTION = 'event_feeds'
+    NEED_SYNC = True
+    INDEXES = (
+        {'name': [('user', 1), ('starts_at', 1)]},
+        {'name': [('user', 1), ('long_event', 1), ('until', 1)]},
+        {'name': [('user', 1), ('event_id', 1)], 'unique': True},
+        {'name': 'event_id'},
+    )
+
+    @classmethod
+    def is_long(cls, starts_at, ends_at):
+        return (ends_at is not None and
+                ends_at - starts_at > cls.LONG_DURATION)
+
+    @classmethod
+    def event_fields(cls, event):
+        return {
+            'title': event.title,
+            'starts_at': event.starts_at,
+            'ends_at': event.ends_at,
+            'until': event.ends_at or event.starts_at,
+            'long_event': cls.is_long(event.starts_at, event.ends_at),
+        }
+
+    @classmethod
+    @gen.coroutine
+    def fan_out(cls, db, event, op):
+        if op == EventChangeLog.DELETE:
+            yield cls.remove_entries(db, {'event_id': event.pk})
+            return
+        removed = event._stored_participants.difference(event.participants())
+        if removed:
+            yield cls.remove_entries(db, {'event_id': event.pk,
+                                          'user': {'$in': list(removed)}})
+        if event.owner:
+            yield cls.write_entries(db, event, [event.owner], cls.OWNER)
+        attendees = list(event.attendees or ())
+        if not event.fanout:
+            # Refresh entries of attendees who responded
+            yield cls().update(db, query={'event_id': event.pk,
+                                          'role': cls.ATTENDEE},
+                               update={'$set': cls.event_fields(event)},
+                               multi=True)
+        elif len(attendees) <= cls.FANOUT_BACKGROUND:
+            yield cls.write_entries(db, event, attendees, cls.ATTENDEE)
+        # Otherwise entries are written by `events.fan_out` job
+
+    @classmethod
+    def entry_updates(cls, event, users, role, status=None):
+        """
+        Returns `(query, update)` pairs which upsert entries of the users.
+        """
+        fields = cls.event_fields(event)
+        fields['role'] = role
+        on_insert = {'status': status or (
+            cls.ACCEPTED if role == cls.OWNER else cls.PENDING)}
+        return [({'user': user, 'event_id': event.pk},
+                 {'$set': fields, '$setOnInsert': on_insert})
+                for user in users]
+
+    @classmethod
+    @gen.coroutine
+    def write_entries(cls, db, event, users, role, status=None):
+        yield cls.bulk_update(db, cls.entry_updates(event, users, role,
+                                                    status), upsert=True)
+
+    @classmethod
+    @gen.coroutine
+    def respond(cls, db, user, event_id, status):
+        """
+        Sets invitation status of the attendee. Returns False if the user
+        is not invited to the event.
+        """
+        event = yield Event.find_one(db, {'_id': event_id,
+                                          'attendees': user})
+        if event is None:
+            raise gen.Return(False)
+        fields = cls.event_fields(event)
+        fields.update(role=cls.ATTENDEE, status=status)
+        yield cls().update(db, query={'user': user, 'event_id': event_id},
+                           update={'$set': fields}, upsert=True)
+        raise gen.Return(True)
+
+    @classmethod
+    @gen.coroutine
+    def window(cls, db, user, start, end):
+        """
+        Returns feed entries of the user which overlap `[start, end)`
+        ordered by start time. Scans are bounded by `starts_at` from
+        `LONG_DURATION` before the window, so they grow with the window,
+        long events are found by their end.
+        """
+        scan_start = start - cls.LONG_DURATION
+        cursor = cls.get_cursor(db, {'$or': [
+            {'user': user,
+             'starts_at': {'$gte': scan_start, '$lt': end},
+             'until': {'$gte': start}},
+            {'user': user,
+             'long_event': True,
+             'until': {'$gte': start},
+             'starts_at': {'$lt': end}},
+        ]})
+        entries = yield cls.find(cursor, model=False)
+        cursor = Event.get_cursor(db, {'$or': [
+            {'attendees': user,
+             'fanout': False,
+             'starts_at': {'$gte': scan_start, '$lt': end}},
+            {'attendees': user,
+             'fanout': False,
+             'long_event': True,
+             'ends_at': {'$gte': start},
+             'starts_at': {'$lt': end}},
+        ]}, fields={'title': True, 'starts_at': True, 'ends_at': True})
+        merged = yield Event.find(cursor, model=False)
+        found_ids = set(entry['event_id'] for entry in entries)
+        for event in merged:
+            until = event.get('ends_at') or event['starts_at']
+            if event['_id'] in found_ids or until < start:
+                continue
+            entries.append({
+                'user': user,
+                'event_id': event['_id'],
+                'title': event.get('title', ''),
+                'starts_at': event['starts_at'],
+                'ends_at': event.get('ends_at'),
+                'until': until,
+                'long_event': cls.is_long(event['starts_at'],
+                                          event.get('ends_at')),
+                'role': cls.ATTENDEE,
+                'status': cls.PENDING,
+            })
+        entries.sort(key=lambda entry: entry['starts_at'])
+        raise gen.Return(entries)
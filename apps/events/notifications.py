@@ -0,0 +1,131 @@
+"""
+Live event updates for the connected WebSocket clients. Updates are
+published to Redis channel of the user, so they reach clients of all web
+processes whichever process (or job worker) made the change. Every web
+process runs `start_listener` thread which is subscribed to the channels
+of its connected users only and passes updates to the connections through
+the IOLoop. Without `configure` updates are delivered in process only.
+Updates published before the channel is subscribed are not delivered,
+clients catch up with the sync token. Connection must have
+`queue_update(update)` method, connections with true `remote_only`
+attribute get updates of other processes only.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from redis.exceptions import RedisError
+
+from ..core.utils import json_default
+
+logger = logging.getLogger(__name__)
+CHANNEL_PREFIX = 'calendio:event-updates:'
+LISTENER_POLL_TIMEOUT = 0.5  # sec, delay of channels subscription
+LISTENER_RETRY_DELAY = 5  # sec
+# Updates published by this process are not remote ones
+ORIGIN = uuid.uuid4().hex
+_subscribers = {}
+# `(subscribe, user)` changes of the channels for the listener thread
+_channel_changes = queue.Queue()
+_redis = None
+
+
+def configure(redis):
+    global _redis
+    _redis = redis
+
+
+def start_listener(io_loop):
+    """
+    Starts daemon thread delivering published updates to the connections
+    of this process.
+    """
+    thread = threading.Thread(target=_listen, args=(io_loop,),
+                              name='event-updates')
+    thread.daemon = True
+    thread.start()
+
+
+def _channel(user):
+    return CHANNEL_PREFIX + user
+
+
+def _listen(io_loop):
+    while True:
+        try:
+            pubsub = _redis.pubsub(ignore_subscribe_messages=True)
+            # Prefix channel keeps the connection while no user is connected
+            pubsub.subscribe(CHANNEL_PREFIX)
+            while not _channel_changes.empty():
+                _channel_changes.get_nowait()
+            users = list(_subscribers)
+            if users:
+                pubsub.subscribe(*[_channel(user) for user in users])
+            while True:
+                while not _channel_changes.empty():
+                    subscribe, user = _channel_changes.get_nowait()
+                    if subscribe:
+                        pubsub.subscribe(_channel(user))
+                    else:
+                        pubsub.unsubscribe(_channel(user))
+                message = pubsub.get_message(timeout=LISTENER_POLL_TIMEOUT)
+                if message is None:
+                    continue
+                user = message['channel'].decode('utf-8')[
+                    len(CHANNEL_PREFIX):]
+                data = json.loads(message['data'].decode('utf-8'))
+                io_loop.add_callback(_deliver, user, data['update'],
+                                     data['origin'] != ORIGIN)
+        except RedisError as e:
+            logger.error('Event updates listener failed, retry in {0}s: '
+                         '{1}'.format(LISTENER_RETRY_DELAY, e))
+            time.sleep(LISTENER_RETRY_DELAY)
+
+
+def subscribe(user, connection):
+    connections = _subscribers.setdefault(user, set())
+    if not connections:
+        _channel_changes.put((True, user))
+    connections.add(connection)
+
+
+def unsubscribe(user, connection):
+    connections = _subscribers.get(user)
+    if connections is None:
+        return
+    connections.discard(connection)
+    if not connections:
+        del _subscribers[user]
+        _channel_changes.put((False, user))
+
+
+def send_event_notifications(updates):
+    """
+    Queues updates to all connections of the users, `updates` is list of
+    `(user, update)`. Updates of one event write are published with one
+    request.
+    """
+    if not updates:
+        return
+    if _redis is not None:
+        pipe = _redis.pipeline(transaction=False)
+        for user, update in updates:
+            pipe.publish(_channel(user), json.dumps(
+                {'origin': ORIGIN, 'update': update}, default=json_default))
+        try:
+            pipe.execute()
+            return
+        except RedisError as e:
+            logger.warning('Event updates are delivered in process only: '
+                           '{0}'.format(e))
+    for user, update in updates:
+        _deliver(user, update)
+
+
+def _deliver(user, update, remote=False):
+    for connection in list(_subscribers.get(user, ())):
+        if remote or not getattr(connection, 'remote_only', False):
+            connection.queue_update(update)
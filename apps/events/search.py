@@ -0,0 +1,241 @@
+"""
+In-process prefix index of user events for type-ahead search.
+Full text queries are served by the Mongo text index of `Event` collection.
+"""
+import bisect
+import logging
+import re
+import time
+from collections import OrderedDict
+
+from tornado import gen
+
+from .notifications import subscribe, unsubscribe
+
+logger = logging.getLogger(__name__)
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower()) if text else []
+
+
+def event_terms(event):
+    """
+    Returns set of terms the event is found by.
+    """
+    terms = set()
+    for text in (event.title, event.description, event.location):
+        terms.update(tokenize(text))
+    for email in event.attendees or ():
+        terms.add(email.lower())
+        terms.update(tokenize(email))
+    return terms
+
+
+class PrefixIndex(object):
+    """
+    Sorted array of `(term, event_id)` pairs. Events having all query words
+    as term prefixes are found by binary search without database access.
+    """
+
+    def __init__(self):
+        self.built_at = time.time()
+        self._entries = []
+        self._terms = {}
+        self._titles = {}
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, event_id):
+        return event_id in self._terms
+
+    @classmethod
+    def build(cls, events):
+        """
+        Returns index of events. Entries are sorted once, `add` inserts
+        every entry separately and is for incremental updates only.
+        """
+        index = cls()
+        for event in events:
+            terms = event_terms(event)
+            index._entries.extend((term, event.pk) for term in terms)
+            index._terms[event.pk] = terms
+            index._titles[event.pk] = event.title
+        index._entries.sort()
+        return index
+
+    def add(self, event):
+        event_id = event.pk
+        self.remove(event_id)
+        terms = event_terms(event)
+        for term in terms:
+            bisect.insort(self._entries, (term, event_id))
+        self._terms[event_id] = terms
+        self._titles[event_id] = event.title
+
+    def remove(self, event_id):
+        terms = self._terms.pop(event_id, None)
+        if terms is None:
+            return
+        for term in terms:
+            i = bisect.bisect_left(self._entries, (term, event_id))
+            del self._entries[i]
+        del self._titles[event_id]
+
+    def _find_prefix(self, prefix):
+        found = set()
+        i = bisect.bisect_left(self._entries, (prefix,))
+        while i < len(self._entries):
+            term, event_id = self._entries[i]
+            if not term.startswith(prefix):
+                break
+            found.add(event_id)
+            i += 1
+        return found
+
+    def complete(self, query, limit=10):
+        """
+        Returns list of `(event_id, title)` sorted by title.
+        """
+        found = None
+        for word in tokenize(query):
+            ids = self._find_prefix(word)
+            found = ids if found is None else found & ids
+            if not found:
+                return []
+        if found is None:
+            return []
+        return sorted(((event_id, self._titles[event_id])
+                       for event_id in found),
+                      key=lambda item: item[1].lower())[:limit]
+
+
+class IndexWatcher(object):
+    """
+    Drops the prefix index of the user when the user events are changed by
+    other process, see `notifications`.
+    """
+
+    remote_only = True
+
+    def __init__(self, registry, user):
+        self.registry = registry
+        self.user = user
+
+    def queue_update(self, update):
+        self.registry.invalidate([self.user])
+
+
+class PrefixIndexRegistry(object):
+    """
+    Prefix indexes of recently active users. Index is built lazily on the
+    first autocomplete request and kept up to date by the event writes of
+    this process. Writes during the build are applied to the built index.
+    Index is dropped on writes of other processes and rebuilt after
+    `max_age` seconds in case their updates are lost.
+    """
+
+    def __init__(self, max_users=1000, max_age=300, max_events=10000):
+        self.max_users = max_users
+        self.max_age = max_age
+        self.max_events = max_events
+        self._indexes = OrderedDict()
+        self._building = {}
+        # Writes to apply to the indexes being built, `(op, arg)` list
+        self._pending = {}
+        self._watchers = {}
+
+    @gen.coroutine
+    def get(self, db, user):
+        index = self._indexes.get(user)
+        if index is None or time.time() - index.built_at > self.max_age:
+            # Concurrent requests of the user wait for the same build
+            future = self._building.get(user)
+            if future is None:
+                future = self._building[user] = self.build(db, user)
+                future.add_done_callback(
+                    lambda f: self._building.pop(user, None))
+            index = yield future
+        else:
+            self._indexes.move_to_end(user)
+        raise gen.Return(index)
+
+    @gen.coroutine
+    def build(self, db, user):
+        from .models import Event
+
+        # Watched before the events are read, so no change is missed
+        self._watch(user)
+        self._pending[user] = []
+        try:
+            cursor = Event.get_cursor(db, Event.user_query(user), fields={
+                'title': True, 'description': True, 'location': True,
+                'attendees': True})
+            events = yield Event.find(cursor, list_len=self.max_events)
+        except Exception:
+            del self._pending[user]
+            if user not in self._indexes:
+                self._unwatch(user)
+            raise
+        pending = self._pending.pop(user)
+        index = PrefixIndex.build(events)
+        for op, arg in pending:
+            if op == 'add':
+                index.add(arg)
+            elif op == 'remove':
+                index.remove(arg)
+            else:
+                # Changed by other process, rebuilt on the next request
+                index.built_at = 0
+        self._indexes[user] = index
+        self._indexes.move_to_end(user)
+        while len(self._indexes) > self.max_users:
+            self._unwatch(self._indexes.popitem(last=False)[0])
+        logger.debug('Prefix index of {0} is built: {1} events'.format(
+            user, len(index)))
+        raise gen.Return(index)
+
+    def index_event(self, event):
+        users = set(event.participants())
+        for user, index in self._indexes.items():
+            if user in users:
+                index.add(event)
+            elif event.pk in index:
+                # User is not an attendee anymore
+                index.remove(event.pk)
+        for user, pending in self._pending.items():
+            if user in users:
+                pending.append(('add', event))
+            else:
+                pending.append(('remove', event.pk))
+
+    def remove_event(self, event_id):
+        for index in self._indexes.values():
+            index.remove(event_id)
+        for pending in self._pending.values():
+            pending.append(('remove', event_id))
+
+    def invalidate(self, users):
+        for user in users:
+            if user in self._pending:
+                self._pending[user].append(('stale', None))
+            if self._indexes.pop(user, None) is not None:
+                self._unwatch(user)
+
+    def _watch(self, user):
+        if user not in self._watchers:
+            self._watchers[user] = IndexWatcher(self, user)
+            subscribe(user, self._watchers[user])
+
+    def _unwatch(self, user):
+        if user in self._pending:
+            # Watched by the build
+            return
+        watcher = self._watchers.pop(user, None)
+        if watcher is not None:
+            unsubscribe(user, watcher)
+
+
+prefix_indexes = PrefixIndexRegistry()
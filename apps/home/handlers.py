@@ -1,12 +1,43 @@
 import logging
+from datetime import datetime, timedelta
 
+from tornado import gen
+
+from ..core.cache import fragment_cache
 from ..core.handlers import BaseHandler
 from ..core.utils import authenticated
+from ..events.models import FeedEntry
 
 logger = logging.getLogger(__name__)
 
 
 class MainHandler(BaseHandler):
+    UPCOMING_DAYS = 7
+
+    @gen.coroutine
     @authenticated()
     def get(self):
-        self.render('index.html')
+        upcoming = yield self.get_upcoming()
+        self.render('index.html', upcoming=upcoming)
+
+    @gen.coroutine
+    def get_upcoming(self):
+        """
+        Returns rendered list of the user events for the next days. It is
+        cached until the user calendar is changed, so feed is not read on
+        repeat views.
+        """
+        today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        cache_key = fragment_cache.key(
+            'upcoming:{0:%Y-%m-%d}'.format(today),
+            ['calendar:{0}'.format(self.current_user)])
+        upcoming = fragment_cache.get(cache_key)
+        if upcoming is None:
+            entries = yield FeedEntry.window(
+                self.db, self.current_user, today,
+                today + timedelta(days=self.UPCOMING_DAYS))
+            template = self.application.jinja_env.get_template(
+                'events/upcoming.html')
+            upcoming = template.render(entries=entries)
+            fragment_cache.set(cache_key, upcoming)
+        raise gen.Return(upcoming)
@@ -7,6 +7,8 @@ from tornado.options import define, options
 from jinja2 import Environment, FileSystemLoader
 import motor
 
+from apps.core.log import start_listeners as start_log_listeners
+
 
 # Paths
 ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -30,11 +32,26 @@ APP_SETTINGS = {
     'debug': options.debug,
     'template_path': TEMPLATE_ROOT,
     'static_path': STATIC_ROOT,
+    'media_collection': 'media',  # GridFS
     'cookie_secret': base64.b64encode(uuid.uuid4().bytes + uuid.uuid4().bytes),
     'xsrf_cookies': True,
     'login_url': '/login',
     'db': motor.MotorClient(MONGO_DB['host'],
                             MONGO_DB['port'])[MONGO_DB['db_name']],
+    'photo_upload': {
+        'max_size': 10 * 1024 * 1024,  # bytes
+        'collection': 'uploads',  # GridFS
+        'sizes': {
+            'thumb': (64, 64),
+            'medium': (256, 256),
+        },
+    },
+}
+
+# Redis
+REDIS = {
+    'host': 'localhost',
+    'port': 6379,
 }
 
 # Sessions
@@ -42,8 +59,8 @@ SESSION_STORE = {
     'pycket': {
         'engine': 'redis',
         'storage': {
-            'host': 'localhost',
-            'port': 6379,
+            'host': REDIS['host'],
+            'port': REDIS['port'],
             'db_sessions': 10,
             'db_notifications': 11,
             'max_connections': 2 ** 31,
@@ -56,10 +73,50 @@ SESSION_STORE = {
 
 APP_SETTINGS.update(SESSION_STORE)
 
+# Live event updates are published to Redis, see `apps.events.notifications`
+NOTIFICATIONS = {
+    'redis_db': SESSION_STORE['pycket']['storage']['db_notifications'],
+}
+
+# Admission control. Limits are set by route name and apply to POST
+# requests by default, see
+# `apps.core.admission.AdmissionPolicy` for route options
+ADMISSION_CONTROL = {
+    'redis_db': 12,
+    'redis_timeout': 0.1,  # sec
+    'routes': {
+        'login': {'rate': 50, 'burst': 100, 'concurrency': 20},
+        'signup': {'rate': 10, 'burst': 20, 'concurrency': 10},
+    },
+}
+
+# Background jobs, see `apps.core.jobs`. Workers are run by `invoke worker`
+JOB_QUEUE = {
+    'redis_db': 14,
+    'result_ttl': 24 * 60 * 60,  # sec
+    # Jobs of the worker which doesn't renew its lease are queued again
+    'lease_timeout': 30,  # sec
+    'modules': [
+        'apps.account.jobs',
+        'apps.events.jobs',
+    ],
+}
+
 # Template
 JINJA_ENV = Environment(loader=FileSystemLoader(TEMPLATE_ROOT),
                         auto_reload=options.debug,
-                        autoescape=False)
+                        autoescape=False,
+                        extensions=['apps.core.cache.FragmentCacheExtension'])
+
+# Rendered template fragments cache, see `apps.core.cache.FragmentCache`.
+# It is for expensive fragments only, cheap ones are faster to render
+FRAGMENT_CACHE = {
+    'redis_db': 13,
+    'redis_timeout': 0.1,  # sec
+    'timeout': 60 * 60,  # sec
+    'l1_size': 1000,  # fragments
+    'versions_ttl': 5,  # sec, invalidations delay for other processes
+}
 
 # Logging
 if options.debug:
@@ -67,20 +124,44 @@ if options.debug:
 else:
     LOG_LEVEL = logging.INFO
 
+# Records are queued by the `queue` handler and written by the background
+# thread through the handlers of `apps.core.log.SINK_LOGGER` logger.
+# Sampling and rate limits are set for the known noisy loggers only
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
     'formatters': {
         'main_formatter': {
-            'format': '%(levelname)s:%(name)s: %(message)s '
-            '(%(asctime)s; %(filename)s:%(lineno)d)',
+            '()': 'apps.core.log.JSONFormatter',
             'datefmt': "%Y-%m-%d %H:%M:%S",
         },
         'console_formatter': {
             'format': '%(message)s',
         },
     },
+    'filters': {
+        'request_id': {
+            '()': 'apps.core.log.RequestIdFilter',
+        },
+        'sampling': {
+            '()': 'apps.core.log.SamplingFilter',
+            'rate': 0.1,
+            'max_level': logging.DEBUG,
+        },
+        'rate_limit': {
+            '()': 'apps.core.log.RateLimitFilter',
+            'rate': 10,  # records per second from the same line
+            'burst': 50,
+            'max_level': logging.WARNING,
+        },
+    },
     'handlers': {
+        'queue': {
+            '()': 'apps.core.log.DroppingQueueHandler',
+            'level': LOG_LEVEL,
+            'filters': ['request_id'],
+            'maxsize': 10000,  # records
+        },
         'rotate_file': {
             'level': LOG_LEVEL,
             'class': 'logging.handlers.TimedRotatingFileHandler',
@@ -98,13 +179,23 @@ LOGGING = {
     },
     'loggers': {
         '': {
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
+        },
+        # Per-update "Update result" and per-document unknown fields
+        'apps.core.models': {
+            'filters': ['sampling', 'rate_limit'],
+        },
+        'calendio.sink': {
             'handlers': ['rotate_file', 'console'],
             'level': LOG_LEVEL,
-        }
+            'propagate': False,
+        },
     }
 }
 
 logging.config.dictConfig(LOGGING)
+start_log_listeners()
 
 if options.config:
     options.parse_config_file(options.config)
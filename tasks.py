@@ -30,13 +30,14 @@ def restore_db(path, host='localhost', port='27017', username='', password=''):
 def syncdb():
     from pymongo import MongoClient
     from settings import MONGO_DB
-    from core.models import User, City, Event
+    from apps.account.models import User, City
+    from apps.events.models import Event, EventChangeLog, FeedEntry
 
     db = MongoClient(host=MONGO_DB['host'],
                      port=MONGO_DB['port']
                      )[MONGO_DB['db_name']]
 
-    models = [User, City, Event]
+    models = [User, City, Event, EventChangeLog, FeedEntry]
     for model in models:
         if hasattr(model, 'NEED_SYNC'):
             collection = model.MONGO_COLLECTION
@@ -46,3 +47,93 @@ def syncdb():
                 db[collection].create_index(i_name, **index)
                 logger.info('Create index on {0}'.format(collection))
     logger.info('All collections is synchronized!')
+
+
+@task
+def bench_validation(events=100, requests=100):
+    """Benchmark bulk events payload validation: plain vs compiled."""
+    import timeit
+    from apps.events.forms import EventForm
+
+    class PlainEventForm(EventForm):
+        _compiled = False
+
+    events, requests = int(events), int(requests)
+    payload = [{
+        'title': ['Event #{0}'.format(i)],
+        'description': ['Description of event #{0}'.format(i)],
+        'location': ['Room {0}'.format(i % 10)],
+        'starts_at': ['2015-09-01 10:00:00'],
+        'ends_at': ['2015-09-01 11:30:00'],
+    } for i in range(events)]
+
+    def validate(form_class):
+        for data in payload:
+            form = form_class(data)
+            assert form.validate(), form.errors
+
+    for form_class in (PlainEventForm, EventForm):
+        spent = timeit.timeit(lambda: validate(form_class), number=requests)
+        print('{0}: {1} requests x {2} events, {3:.3f}s '
+              '({4:.1f} us/event)'.format(
+                  form_class.__name__, requests, events, spent,
+                  spent * 10 ** 6 / (requests * events)))
+
+
+def _run_worker():
+    import importlib
+    from pymongo import MongoClient
+    from redis import StrictRedis
+    from settings import (MONGO_DB, REDIS, JOB_QUEUE, FRAGMENT_CACHE,
+                          NOTIFICATIONS)
+    from apps.core.cache import fragment_cache
+    from apps.core.jobs import job_queue, Worker
+    from apps.events import notifications
+
+    for module in JOB_QUEUE['modules']:
+        importlib.import_module(module)
+    fragment_cache.configure(
+        StrictRedis(host=REDIS['host'], port=REDIS['port'],
+                    db=FRAGMENT_CACHE['redis_db']),
+        timeout=FRAGMENT_CACHE['timeout'],
+        versions_ttl=FRAGMENT_CACHE['versions_ttl'])
+    notifications.configure(StrictRedis(host=REDIS['host'],
+                                        port=REDIS['port'],
+                                        db=NOTIFICATIONS['redis_db']))
+    job_queue.configure(StrictRedis(host=REDIS['host'], port=REDIS['port'],
+                                    db=JOB_QUEUE['redis_db']),
+                        result_ttl=JOB_QUEUE['result_ttl'])
+    db = MongoClient(host=MONGO_DB['host'],
+                     port=MONGO_DB['port']
+                     )[MONGO_DB['db_name']]
+    try:
+        Worker(job_queue, db, lease_timeout=JOB_QUEUE['lease_timeout']).run()
+    except KeyboardInterrupt:
+        pass
+
+
+@task
+def worker(concurrency=2):
+    """Run background jobs worker processes."""
+    import multiprocessing
+    import time
+
+    processes = [multiprocessing.Process(target=_run_worker)
+                 for _ in range(int(concurrency))]
+    for process in processes:
+        process.start()
+    try:
+        # Dead workers are replaced, their jobs are queued again
+        while True:
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.error('Worker process {0} exited with code {1}, '
+                                 'starting a new one'.format(
+                                     process.pid, process.exitcode))
+                    processes[i] = multiprocessing.Process(
+                        target=_run_worker)
+                    processes[i].start()
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for process in processes:
+            process.join()